@@ -1,4 +1,5 @@
 import time
+import numpy as np
 import tool
 
 # micro-benchmark: measure how many paint packets can be created and queued per second
@@ -26,3 +27,16 @@ start = time.time()
 merged = tool.get_merged_data()
 end = time.time()
 print(f"Merged data size: {len(merged) if merged else 0} bytes, cost {(end-start)*1000:.3f} ms")
+
+# batched path: same packets built in one tool.paint_batch call
+idx = np.arange(N, dtype=np.uint32)
+xy = np.stack([idx & 0x3FF, (idx >> 10) & 0x3FF], axis=1)
+rgb = np.stack([idx & 0xFF, (idx >> 8) & 0xFF, (idx >> 16) & 0xFF], axis=1)
+start = time.time()
+tool.paint_batch(None, uid, token_bytes, uid_bytes3, rgb, xy, idx)
+end = time.time()
+duration = end - start
+print(f"Batched {N} paint packets in {duration:.3f}s -> {N/max(duration, 1e-9):.1f} ops/s")
+
+batched = tool.get_merged_data()
+print(f"Batched data matches per-call data: {batched == merged}")
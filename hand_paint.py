@@ -5,8 +5,8 @@ import time
 import struct
 import logging
 import websockets
-import random
 import math
+import heapq
 import os
 from uuid import UUID
 import tool
@@ -28,6 +28,24 @@ PALETTE = [
 
 WS_URL = "wss://paintboard.luogu.me/api/paintboard/ws"
 
+# 调色板布局
+PALETTE_BAR_H = 40
+SWATCH_SIZE = 30
+SWATCH_MARGIN = 5
+PALETTE_START_X = 10
+
+# 画板更新广播 (0xfa) 的负载格式：x(2) y(2) r g b
+PIXEL_UPDATE = struct.Struct('<HHBBB')
+
+# 待发送绘画队列上限，超出后丢弃新的绘画请求以提供背压
+SEND_QUEUE_MAXSIZE = 4096
+
+# 每次从 os.urandom 批量生成的 paint_id 数量
+PAINT_ID_BATCH = struct.Struct('<1024I')
+
+# 画面无变化时的最长重绘间隔（秒），用于刷新 FPS/Token 等状态文字
+RENDER_IDLE_REFRESH = 0.5
+
 class PaintApp:
     def __init__(self, config, users_with_tokens):
         self.config = config
@@ -63,22 +81,52 @@ class PaintApp:
         self.selected_color = (0, 0, 0)
         self.painting = False
         self.last_paint_pos = None
+        # 上一个入队的 (x, y, color)，跳过连续重复的同一像素（线段首尾相接、慢速拖动）
+        self._last_queued = None
         
         # Token 管理
         self.tokens = []
+        # 按可用时间排序的最小堆 [(ready_at, idx)]，idx 指向 self.tokens
+        self._token_heap = []
         self.user_cooldown = self.config.get('user_cooldown_seconds', 30)
         self.load_tokens(users_with_tokens)
         
         # WebSocket
         self.ws = None
         self.connected = False
+        # 待发送绘画队列，由单个发送任务消费
+        self._send_q = asyncio.Queue(maxsize=SEND_QUEUE_MAXSIZE)
+        # 预生成的 paint_id 池，用完后批量补充
+        self._paint_ids = []
         
         # 统计
         self.paint_count = 0
         self.start_time = time.time()
+        # 每帧缓存一次的单调时钟读数，供 Token 冷却判断复用
+        self._now = time.monotonic()
         
         # 初始快照
         self.snapshot_loaded = False
+        self.snapshot_loading = False
+        # 快照下载的线程池 Future；连接断开时保留，重连后复用而不重复下载
+        self._board_future = None
+        # 快照下载期间写入画板的像素 [(x, y, color), ...]，blit 快照后按顺序重放
+        self._pending_writes = None
+        
+        # 可视区域缩放结果缓存：画板内容未变且可视区域/缩放不变时直接复用
+        self._dirty = True
+        self._scaled_key = None
+        self._scaled_sub = None
+        # 复用的缩放目标表面，仅在所需尺寸超过当前大小时重新分配
+        self._scale_dest = None
+        # 有输入事件时需要重绘；否则仅按 RENDER_IDLE_REFRESH 间隔刷新
+        self._needs_redraw = True
+        self._last_full_render = 0.0
+        
+        # 调色板渲染缓存（窗口宽度变化时失效）
+        self._palette_cache = None
+        self._palette_cache_w = -1
+        self._rebuild_palette_layout()
 
     def load_tokens(self, users_with_tokens):
         print(f"正在加载 {len(users_with_tokens)} 个用户的 Token...")
@@ -93,6 +141,7 @@ class PaintApp:
                 token_bytes = bytes.fromhex(token.replace('-', ''))
                 if len(token_bytes) != 16:
                     token_bytes = UUID(token).bytes
+                uid_bytes = int(uid).to_bytes(3, 'little')
             except Exception:
                 print(f"Token 格式错误 uid={uid}")
                 continue
@@ -101,63 +150,143 @@ class PaintApp:
                 'uid': uid,
                 'token': token,
                 'token_bytes': token_bytes,
+                'uid_bytes': uid_bytes,
                 'last_used': 0,
                 'cooldown': self.user_cooldown
             })
+        # last_used 为单调时钟时间；从未使用过（0）的 Token 立即可用
+        self._token_heap = [((t['last_used'] + t['cooldown']) if t['last_used'] else 0.0, i)
+                            for i, t in enumerate(self.tokens)]
+        heapq.heapify(self._token_heap)
         print(f"成功加载 {len(self.tokens)} 个可用 Token")
 
-    def fetch_board(self):
-        if self.snapshot_loaded:
+    async def fetch_board_async(self):
+        """在线程池中下载画板快照，避免阻塞界面；下载完成后在主线程渲染到画板表面
+
+        下载期间收到的 0xfa 更新和本地绘制照常写入画板，同时记入 _pending_writes，
+        快照 blit 之后按原顺序重放，避免被更早的快照内容覆盖。
+        """
+        if self.snapshot_loaded or self.snapshot_loading:
             return
-        print("正在下载绘板快照...")
-        board_data = tool.fetch_board_snapshot()
-        if board_data:
-            print("快照下载完成，正在渲染...")
-            px_array = pygame.PixelArray(self.board_surface)
-            for (x, y), color in board_data.items():
-                if 0 <= x < self.width and 0 <= y < self.height:
-                    px_array[x, y] = color
-            del px_array
-            print("渲染完成")
-            self.snapshot_loaded = True
-        else:
-            print("获取快照失败，使用空白画板")
+        self.snapshot_loading = True
+        self._needs_redraw = True
+        loop = asyncio.get_running_loop()
+        fut = self._board_future
+        if fut is None or fut.get_loop() is not loop:
+            print("正在下载绘板快照...")
+            fut = loop.run_in_executor(None, tool.fetch_board_bytes)
+            self._board_future = fut
+            self._pending_writes = []
+        try:
+            # shield：任务被取消时后台下载继续，重连后等待同一个结果
+            board_bytes = await asyncio.shield(fut)
+            pending = self._pending_writes
+            self._pending_writes = None
+            if board_bytes:
+                print("快照下载完成，正在渲染...")
+                # 原始数据即按行优先排列的 RGB 字节，直接包装为 Surface 整体 blit，无需逐像素写入
+                expected = self.width * self.height * 3
+                if len(board_bytes) < expected:
+                    # 数据不足时以白色补齐，与空白画板一致
+                    board_bytes = board_bytes + b'\xff' * (expected - len(board_bytes))
+                elif len(board_bytes) > expected:
+                    board_bytes = board_bytes[:expected]
+                snapshot_surf = pygame.image.frombuffer(board_bytes, (self.width, self.height), 'RGB')
+                self.board_surface.blit(snapshot_surf, (0, 0))
+                if pending:
+                    px_array = pygame.PixelArray(self.board_surface)
+                    try:
+                        for x, y, color in pending:
+                            px_array[x, y] = color
+                    finally:
+                        del px_array
+                self._dirty = True
+                print("渲染完成")
+                self.snapshot_loaded = True
+            else:
+                print("获取快照失败，使用空白画板")
+        finally:
+            if fut.done():
+                self._board_future = None
+                self._pending_writes = None
+            self.snapshot_loading = False
+            self._needs_redraw = True
 
-    def get_available_token(self):
-        now = time.time()
-        for t in self.tokens:
-            if now - t['last_used'] >= t['cooldown']:
-                return t
-        return None
+    def get_available_token(self, now=None):
+        """取出一个已冷却完毕的 Token 并标记为已使用（堆顶即最早可用者，O(log n)）"""
+        heap = self._token_heap
+        if not heap:
+            return None
+        if now is None:
+            now = self._now
+        ready_at, idx = heap[0]
+        if ready_at > now:
+            return None
+        t = self.tokens[idx]
+        t['last_used'] = now
+        heapq.heapreplace(heap, (now + t['cooldown'], idx))
+        return t
 
-    def get_available_count(self):
-        now = time.time()
+    def get_available_count(self, now=None):
+        """统计当前可用 Token 数：只遍历堆中 ready_at <= now 的部分"""
+        heap = self._token_heap
+        n = len(heap)
+        if n == 0:
+            return 0
+        if now is None:
+            now = self._now
         count = 0
-        for t in self.tokens:
-            if now - t['last_used'] >= t['cooldown']:
-                count += 1
+        stack = [0] if heap[0][0] <= now else []
+        while stack:
+            i = stack.pop()
+            count += 1
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < n and heap[c][0] <= now:
+                    stack.append(c)
         return count
 
-    async def send_paint(self, x, y, color):
-        token_info = self.get_available_token()
+    def next_paint_id(self):
+        """取一个 32 位 paint_id（无需密码学强度，批量生成以降低每次开销）"""
+        ids = self._paint_ids
+        if not ids:
+            ids.extend(PAINT_ID_BATCH.unpack(os.urandom(PAINT_ID_BATCH.size)))
+        return ids.pop()
+
+    def queue_paint(self, x, y, color):
+        """将绘画请求放入发送队列（非阻塞），队列已满时丢弃"""
+        try:
+            self._send_q.put_nowait((x, y, color))
+            return True
+        except asyncio.QueueFull:
+            logging.debug(f"发送队列已满，丢弃绘画 ({x}, {y})")
+            return False
+
+    async def _sender(self):
+        """单个长期运行的发送任务：依次取出绘画请求，等待可用 Token 后发送"""
+        while True:
+            x, y, color = await self._send_q.get()
+            token_info = self.get_available_token(time.monotonic())
+            while token_info is None:
+                # 堆顶即最早冷却完毕的 Token，直接睡到它可用为止，而非轮询
+                heap = self._token_heap
+                wait = (heap[0][0] - time.monotonic()) if heap else 1.0
+                await asyncio.sleep(max(0.0, wait))
+                token_info = self.get_available_token(time.monotonic())
+            await self.send_paint(x, y, color, token_info)
+
+    async def send_paint(self, x, y, color, token_info=None):
+        if token_info is None:
+            token_info = self.get_available_token()
         if not token_info:
             return False
         
-        token_info['last_used'] = time.time()
-        
         r, g, b = color
-        uid = token_info['uid']
+        uid_bytes = token_info['uid_bytes']
         token_bytes = token_info['token_bytes']
-        paint_id = random.randint(0, 4294967295)
+        paint_id = self.next_paint_id()
         
-        packet = bytearray(31)
-        packet[0] = 0xfe
-        packet[1:3] = x.to_bytes(2, 'little')
-        packet[3:5] = y.to_bytes(2, 'little')
-        packet[5:8] = bytes((r, g, b))
-        packet[8:11] = uid.to_bytes(3, 'little')
-        packet[11:27] = token_bytes
-        packet[27:31] = paint_id.to_bytes(4, 'little')
+        # 复用 tool 中预编译的 31 字节绘画包格式，一次打包
+        packet = tool.PAINT_PACKET.pack(0xfe, x, y, r, g, b, uid_bytes, token_bytes, paint_id)
         
         if self.ws and self.connected:
             try:
@@ -197,23 +326,35 @@ class PaintApp:
         
         return points
 
+    def _rebuild_palette_layout(self):
+        """按当前窗口尺寸计算调色板位置与各色块矩形（屏幕坐标），供绘制与点击检测共用"""
+        self._palette_y = self.screen_height - PALETTE_BAR_H
+        sy = self._palette_y + (PALETTE_BAR_H - SWATCH_SIZE) // 2
+        self._palette_rects = [
+            pygame.Rect(PALETTE_START_X + i * (SWATCH_SIZE + SWATCH_MARGIN), sy, SWATCH_SIZE, SWATCH_SIZE)
+            for i in range(len(PALETTE))
+        ]
+        self._palette_cache = None
+
     def draw_ui(self):
-        palette_h = 40
-        palette_y = self.screen_height - palette_h
-        pygame.draw.rect(self.screen, (50, 50, 50), (0, palette_y, self.screen_width, palette_h))
+        palette_y = self._palette_y
         
-        swatch_w = 30
-        swatch_h = 30
-        margin = 5
-        start_x = 10
+        # 调色板背景与色块只在首次或窗口宽度变化时渲染一次，之后每帧直接 blit 缓存
+        if self._palette_cache is None or self._palette_cache_w != self.screen_width:
+            surf = pygame.Surface((self.screen_width, PALETTE_BAR_H))
+            surf.fill((50, 50, 50))
+            for color, rect in zip(PALETTE, self._palette_rects):
+                local = rect.move(0, -palette_y)
+                pygame.draw.rect(surf, color, local)
+                pygame.draw.rect(surf, (200, 200, 200), local, 1)
+            self._palette_cache = surf
+            self._palette_cache_w = self.screen_width
+        self.screen.blit(self._palette_cache, (0, palette_y))
         
-        for i, color in enumerate(PALETTE):
-            x = start_x + i * (swatch_w + margin)
-            y = palette_y + (palette_h - swatch_h) // 2
-            if color == self.selected_color:
-                pygame.draw.rect(self.screen, (255, 255, 0), (x-2, y-2, swatch_w+4, swatch_h+4), 2)
-            pygame.draw.rect(self.screen, color, (x, y, swatch_w, swatch_h))
-            pygame.draw.rect(self.screen, (200, 200, 200), (x, y, swatch_w, swatch_h), 1)
+        # 仅绘制当前选中色块的高亮框
+        if self.selected_color in PALETTE:
+            rect = self._palette_rects[PALETTE.index(self.selected_color)]
+            pygame.draw.rect(self.screen, (255, 255, 0), rect.inflate(4, 4), 2)
 
         preview_size = 60
         pygame.draw.rect(self.screen, self.selected_color, (self.screen_width - preview_size - 10, palette_y - preview_size - 10, preview_size, preview_size))
@@ -228,12 +369,17 @@ class PaintApp:
         fps_text = self.font.render(f"FPS: {int(self.clock.get_fps())} | Zoom: {self.zoom:.2f}x", True, (0, 0, 0))
         self.screen.blit(fps_text, (10, 40))
         
+        if self.snapshot_loading:
+            loading_surf = self.large_font.render("正在加载画板快照...", True, (0, 0, 0))
+            self.screen.blit(loading_surf, (10, 80))
+        
         status_text = "已连接" if self.connected else "断开连接"
         status_surf = self.font.render(status_text, True, (0, 100, 0) if self.connected else (200, 0, 0))
         self.screen.blit(status_surf, (10, 60))
 
     def process_events(self):
         for event in pygame.event.get():
+            self._needs_redraw = True
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -241,25 +387,28 @@ class PaintApp:
                 self.screen_width = event.w
                 self.screen_height = event.h
                 self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
+                self._rebuild_palette_layout()
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     mx, my = event.pos
-                    palette_y = self.screen_height - 40
-                    if my >= palette_y:
-                        swatch_w = 30
-                        margin = 5
-                        start_x = 10
-                        idx = (mx - start_x) // (swatch_w + margin)
-                        if 0 <= idx < len(PALETTE):
-                            self.selected_color = PALETTE[idx]
+                    if my >= self._palette_y:
+                        for i, rect in enumerate(self._palette_rects):
+                            if rect.collidepoint(mx, my):
+                                self.selected_color = PALETTE[i]
+                                break
                     else:
                         self.painting = True
+                        self._last_queued = None
                         bx, by = self.screen_to_board(mx, my)
                         if 0 <= bx < self.width and 0 <= by < self.height:
-                            asyncio.create_task(self.send_paint(bx, by, self.selected_color))
+                            self._last_queued = (bx, by, self.selected_color)
+                            if self._pending_writes is not None:
+                                self._pending_writes.append(self._last_queued)
+                            self.queue_paint(bx, by, self.selected_color)
                             self.last_paint_pos = (bx, by)
                             # 立即绘制到本地画板，提供即时反馈
                             self.board_surface.set_at((bx, by), self.selected_color)
+                            self._dirty = True
                 elif event.button == 3:
                     self.dragging = True
                     self.last_mouse_pos = event.pos
@@ -279,6 +428,7 @@ class PaintApp:
                 if event.button == 1:
                     self.painting = False
                     self.last_paint_pos = None
+                    self._last_queued = None
                 elif event.button == 3:
                     self.dragging = False
             elif event.type == pygame.MOUSEMOTION:
@@ -297,19 +447,51 @@ class PaintApp:
                                 self.last_paint_pos[0], self.last_paint_pos[1],
                                 bx, by
                             )
-                            # 绘制线段上的所有点
-                            for px, py in line_points:
-                                if 0 <= px < self.width and 0 <= py < self.height:
-                                    asyncio.create_task(self.send_paint(px, py, self.selected_color))
-                                    # 立即更新本地画板
-                                    self.board_surface.set_at((px, py), self.selected_color)
+                            # 绘制线段上的所有点：整条线只锁定一次画板表面，颜色也只映射一次
+                            px_array = pygame.PixelArray(self.board_surface)
+                            mapped = self.board_surface.map_rgb(self.selected_color)
+                            # 热循环中使用局部变量，避免每个像素重复查找属性
+                            w = self.width
+                            h = self.height
+                            color = self.selected_color
+                            last = self._last_queued
+                            pending = self._pending_writes
+                            queue = self.queue_paint
+                            try:
+                                for px, py in line_points:
+                                    if 0 <= px < w and 0 <= py < h:
+                                        key = (px, py, color)
+                                        if key == last:
+                                            continue
+                                        last = key
+                                        if pending is not None:
+                                            pending.append(key)
+                                        queue(px, py, color)
+                                        # 立即更新本地画板
+                                        px_array[px, py] = mapped
+                            finally:
+                                del px_array
+                            self._last_queued = last
                         else:
                             # 如果没有上一个点，直接绘制当前点
-                            asyncio.create_task(self.send_paint(bx, by, self.selected_color))
-                            self.board_surface.set_at((bx, by), self.selected_color)
+                            key = (bx, by, self.selected_color)
+                            if key != self._last_queued:
+                                self._last_queued = key
+                                if self._pending_writes is not None:
+                                    self._pending_writes.append(key)
+                                self.queue_paint(bx, by, self.selected_color)
+                                self.board_surface.set_at((bx, by), self.selected_color)
                         self.last_paint_pos = (bx, by)
+                        self._dirty = True
 
     def render(self):
+        # 画板与视图均无变化时跳过整帧绘制与 flip，只定期刷新状态文字
+        now = time.monotonic()
+        if not (self._dirty or self._needs_redraw) and now - self._last_full_render < RENDER_IDLE_REFRESH:
+            return
+        self._needs_redraw = False
+        self._last_full_render = now
+        
         self.screen.fill((200, 200, 200))
         bx1, by1 = self.screen_to_board(0, 0)
         bx2, by2 = self.screen_to_board(self.screen_width, self.screen_height)
@@ -321,11 +503,25 @@ class PaintApp:
         if bx2 > bx1 and by2 > by1:
             sub_w = bx2 - bx1
             sub_h = by2 - by1
-            sub_surf = self.board_surface.subsurface((bx1, by1, sub_w, sub_h))
             scale_w = int(sub_w * self.zoom)
             scale_h = int(sub_h * self.zoom)
             if scale_w > 0 and scale_h > 0:
-                scaled_sub = pygame.transform.scale(sub_surf, (scale_w, scale_h))
+                key = (bx1, by1, sub_w, sub_h, scale_w, scale_h)
+                if self._dirty or key != self._scaled_key or self._scaled_sub is None:
+                    dest = self._scale_dest
+                    if dest is None or dest.get_width() < scale_w or dest.get_height() < scale_h:
+                        dest_w = max(scale_w, self.screen_width)
+                        dest_h = max(scale_h, self.screen_height)
+                        dest = pygame.Surface((dest_w, dest_h), 0, self.board_surface)
+                        self._scale_dest = dest
+                    sub_surf = self.board_surface.subsurface((bx1, by1, sub_w, sub_h))
+                    # 直接缩放写入预分配表面的对应区域，避免每次重建都分配新的 Surface
+                    scaled_sub = dest.subsurface((0, 0, scale_w, scale_h))
+                    pygame.transform.scale(sub_surf, (scale_w, scale_h), scaled_sub)
+                    self._scaled_sub = scaled_sub
+                    self._scaled_key = key
+                    self._dirty = False
+                scaled_sub = self._scaled_sub
                 dest_x = bx1 * self.zoom + self.offset_x
                 dest_y = by1 * self.zoom + self.offset_y
                 self.screen.blit(scaled_sub, (dest_x, dest_y))
@@ -342,8 +538,6 @@ async def run_hand_paint(config, users_with_tokens, images_data=None):
         _app_instance = PaintApp(config, users_with_tokens)
     
     app = _app_instance
-    # 确保快照已加载
-    app.fetch_board()
     
     # 代理设置 (复制自 main.py)
     proxy_keys = ['HTTP_PROXY', 'http_proxy', 'HTTPS_PROXY', 'https_proxy', 'ALL_PROXY', 'all_proxy']
@@ -385,39 +579,68 @@ async def run_hand_paint(config, users_with_tokens, images_data=None):
                         msg = await ws.recv()
                         if isinstance(msg, bytes):
                             offset = 0
+                            # 本条消息中的像素更新先收集，扫描结束后一次性写入画板
+                            updates = []
                             while offset < len(msg):
                                 opcode = msg[offset]
                                 offset += 1
                                 if opcode == 0xfa: # 绘画更新
                                     if offset + 7 <= len(msg):
-                                        x = int.from_bytes(msg[offset:offset+2], 'little')
-                                        y = int.from_bytes(msg[offset+2:offset+4], 'little')
-                                        r = msg[offset+4]
-                                        g = msg[offset+5]
-                                        b = msg[offset+6]
+                                        x, y, r, g, b = PIXEL_UPDATE.unpack_from(msg, offset)
                                         offset += 7
                                         if 0 <= x < app.width and 0 <= y < app.height:
-                                            app.board_surface.set_at((x, y), (r, g, b))
+                                            updates.append((x, y, (r, g, b)))
                                 elif opcode == 0xfc: # Ping
                                     await ws.send(bytes([0xfb])) # Pong
                                 elif opcode == 0xff: # 结果
                                     offset += 5
                                 else:
                                     break
+                            if updates:
+                                if app._pending_writes is not None:
+                                    app._pending_writes.extend(updates)
+                                # 整条消息只锁定一次画板表面
+                                px_array = pygame.PixelArray(app.board_surface)
+                                try:
+                                    for x, y, color in updates:
+                                        px_array[x, y] = color
+                                finally:
+                                    del px_array
+                                app._dirty = True
                 except Exception as e:
                     logging.error(f"接收循环错误: {e}")
                     raise
 
             recv_task = asyncio.create_task(receive_loop())
+            send_task = asyncio.create_task(app._sender())
+            # 快照在后台下载，主循环照常刷新界面并显示加载提示
+            fetch_task = asyncio.create_task(app.fetch_board_async())
             
             # 主循环：处理 GUI 和等待
             try:
                 while not recv_task.done():
+                    app._now = time.monotonic()
                     app.process_events()
                     app.render()
                     app.clock.tick(60)
                     await asyncio.sleep(0)
             finally:
+                if not fetch_task.done():
+                    fetch_task.cancel()
+                try:
+                    await fetch_task
+                except asyncio.CancelledError:
+                    pass
+                except Exception:
+                    pass
+                if not send_task.done():
+                    send_task.cancel()
+                try:
+                    await send_task
+                except asyncio.CancelledError:
+                    pass
+                except Exception:
+                    pass
                 if not recv_task.done():
                     recv_task.cancel()
                 try:
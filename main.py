@@ -150,197 +150,6 @@ def save_config(config: dict):
     except Exception:
         logging.exception("保存配置失败")
 
-def append_to_queue(paint_data):
-    """将绘画数据添加到粘包队列"""
-    global paint_queue, total_size
-    paint_queue.append(paint_data)
-    total_size += len(paint_data)
-
-def get_merged_data(max_size=32768):
-    """合并队列中的数据块，最多不超过max_size字节
-    
-    优化：
-    1. 限制单次提取大小，避免超过32KB限制
-    2. 保留未发送的数据在队列中
-    3. 以像素为单位（31字节），不拆分单个像素
-    """
-    global paint_queue, total_size
-    if not paint_queue:
-        return None
-    
-    # 计算可以发送的数据量，以像素为单位（31字节/像素）
-    max_pixels = max_size // 31
-    actual_size = min(total_size, max_pixels * 31)
-    
-    # 如果数据量很小且不急，等待更多
-    if actual_size < 155 and total_size < max_size // 2:  # 5像素
-        return None
-    
-    merged = bytearray(actual_size)
-    offset = 0
-    extracted_chunks = []
-    
-    while paint_queue and offset < actual_size:
-        chunk = paint_queue[0]
-        chunk_len = len(chunk)
-        
-        if offset + chunk_len <= actual_size:
-            # 完整放入
-            merged[offset:offset + chunk_len] = chunk
-            offset += chunk_len
-            paint_queue.popleft()
-            extracted_chunks.append(chunk)
-        else:
-            # 部分放入（以像素为单位）
-            remaining = actual_size - offset
-            pixels_to_take = remaining // 31
-            bytes_to_take = pixels_to_take * 31
-            
-            if bytes_to_take > 0:
-                merged[offset:offset + bytes_to_take] = chunk[:bytes_to_take]
-                offset += bytes_to_take
-                # 修改原始 chunk，移除已提取部分
-                paint_queue[0] = chunk[bytes_to_take:]
-            break
-    
-    total_size -= offset
-    return merged if offset > 0 else None
-
-async def paint(ws, uid, token, r, g, b, x, y, paint_id):
-    """准备绘画数据并加入队列"""
-    try:
-        # token 可能带或不带短横线，UUID 构造器对不同格式略敏感，做兼容处理
-        try:
-            token_bytes = UUID(token).bytes
-        except Exception:
-            # 试着移除短横线后以 hex 形式构造
-            try:
-                token_bytes = UUID(hex=token.replace('-', '')).bytes
-            except Exception as e:
-                logging.error(f"无效的 Token 格式: {token}，创建 UUID 失败: {e}")
-                return
-        # 构造绘画数据包
-        # 操作码 (1) + x (2) + y (2) + rgb (3) + uid (3) + token (16) + id (4) = 31 字节
-        paint_data = bytearray(31)
-        paint_data[0] = 0xfe  # 操作码
-        paint_data[1:3] = x.to_bytes(2, 'little')
-        paint_data[3:5] = y.to_bytes(2, 'little')
-        paint_data[5:8] = [r, g, b]
-        paint_data[8:11] = uid.to_bytes(3, 'little')
-        paint_data[11:27] = token_bytes
-        paint_data[27:31] = paint_id.to_bytes(4, 'little')
-        
-        append_to_queue(paint_data)
-    except Exception as e:
-        logging.error(f"创建绘画数据时出错: {e}")
-
-async def send_paint_data(ws, interval_ms):
-    """定时发送粘合后的绘画数据包，支持动态批量和智能粘包"""
-    max_packet_size = 32768  # 32KB 服务器限制
-    last_send_time = time.monotonic()
-    
-    while True:
-        await asyncio.sleep(interval_ms / 1000.0)
-        # websockets 新旧 API 兼容：优先使用 ws.open，否则使用 not ws.closed
-        try:
-            is_open = getattr(ws, "open", None)
-            if is_open is None:
-                is_open = not getattr(ws, "closed", False)
-        except Exception:
-            is_open = False
-
-        if is_open and paint_queue:
-            merged_data = get_merged_data(max_size=max_packet_size)
-            if merged_data:
-                data_size = len(merged_data)
-                pixel_count = data_size // 31  # 每个像素31字节
-                
-                try:
-                    await ws.send(merged_data)
-                    now = time.monotonic()
-                    actual_interval = (now - last_send_time) * 1000
-                    last_send_time = now
-                    logging.debug(f"发送 {pixel_count}px ({data_size}字节)，间隔{actual_interval:.1f}ms")
-                except websockets.ConnectionClosed:
-                    logging.warning("发送数据时 WebSocket 连接已关闭。")
-                    # 连接关闭时数据已经丢失，不放回队列（会在上层重试机制处理）
-                except Exception as e:
-                    logging.warning(f"发送数据时出错: {e}")
-                    break
-                except Exception as e:
-                    logging.error(f"发送数据时出错: {e}")
-
-def build_target_map(pixels, width, height, start_x, start_y, config=None):
-    """构建目标像素颜色映射：{(abs_x,abs_y): (r,g,b)}，跳过透明与越界。
-
-    更健壮地支持像素格式：RGBA、RGB、灰度等。若像素带 alpha 通道且 alpha==0 则视为透明并跳过。
-    若配置中设置 `ignore_semitransparent` 为 True，则 alpha<255 的像素也会被视为透明并跳过。
-    """
-    target = {}
-    skipped_transparent = 0
-    skipped_out_of_bounds = 0
-    ignore_semi = False
-    if isinstance(config, dict):
-        ignore_semi = bool(config.get('ignore_semitransparent', False))
-
-    total_pixels = width * height
-    for py in range(height):
-        for px in range(width):
-            idx = py * width + px
-            if idx < 0 or idx >= len(pixels):
-                continue
-            p = pixels[idx]
-            try:
-                # 支持多种像素表示
-                if isinstance(p, (list, tuple)):
-                    if len(p) >= 4:
-                        r, g, b, a = p[0], p[1], p[2], p[3]
-                    elif len(p) == 3:
-                        r, g, b = p
-                        a = 255
-                    elif len(p) == 1:
-                        r = g = b = p[0]
-                        a = 255
-                    else:
-                        # 未识别格式，视为透明
-                        skipped_transparent += 1
-                        continue
-                else:
-                    # 纯整数等情况，视为灰度
-                    r = g = b = int(p)
-                    a = 255
-            except Exception:
-                skipped_transparent += 1
-                continue
-
-            # 跳过完全透明像素
-            try:
-                if int(a) == 0:
-                    skipped_transparent += 1
-                    continue
-            except Exception:
-                # 若无法解析 alpha，则保守处理为可见
-                pass
-
-            # 可选：跳过半透明像素
-            if ignore_semi:
-                try:
-                    if 0 < int(a) < 255:
-                        skipped_transparent += 1
-                        continue
-                except Exception:
-                    pass
-
-            abs_x, abs_y = start_x + px, start_y + py
-            if 0 <= abs_x < 1000 and 0 <= abs_y < 600:
-                target[(abs_x, abs_y)] = (int(r), int(g), int(b))
-            else:
-                skipped_out_of_bounds += 1
-
-    logging.debug(f"目标像素数: {len(target)}（非透明且在画布范围内） 已跳过透明: {skipped_transparent} 越界: {skipped_out_of_bounds} 总像素: {total_pixels}")
-    return target
-
-
 def fetch_board_snapshot():
     """通过 HTTP 接口获取当前画板所有像素的快照，返回 dict {(x,y):(r,g,b)}。
 
@@ -362,21 +171,8 @@ def fetch_board_snapshot():
         expected = 1000 * 600 * 3
         if len(data) < expected:
             logging.warning(f"获取画板快照数据长度不够: {len(data)} < {expected}")
-        board = {}
         # 解析为 RGB 每像素 3 字节，小端/大端与顺序在文档中已指明为 r,g,b
-        # 仅填充需要关注的坐标时更高效，上层传入 target_positions 后再筛选
-        # 这里返回完整 map，调用方可根据需要筛选
-        max_len = len(data) - 2
-        for y in range(600):
-            row_base = y * 1000 * 3
-            for x in range(1000):
-                idx = row_base + x * 3
-                if idx + 2 > max_len:
-                    break
-                r = data[idx]
-                g = data[idx + 1]
-                b = data[idx + 2]
-                board[(x, y)] = (r, g, b)
+        board = tool.parse_board_snapshot(data)
         logging.debug("已获取画板快照。")
         return board
     except requests.RequestException as e:
@@ -930,8 +726,10 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                     board_state = snapshot.copy()
                     # 若有 GUI，初始化 GUI 的 board_state（全板快照）
                     if gui_state is not None:
+                        # 在锁外完成整板拷贝，锁内只交换引用，缩短临界区
+                        board_copy = board_state.copy()
                         with gui_state['lock']:
-                            gui_state['board_state'] = board_state.copy()
+                            gui_state['board_state'] = board_copy
                             # expose pos->image mapping (initial)
                             gui_state['pos_to_image_idx'] = pos_to_image_idx
             except Exception:
@@ -1028,6 +826,8 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                         message_count += 1
                         # 更新最后消息接收时间（用于健康检查）
                         last_message_time = time.monotonic()
+                        # 本条消息内的画板更新先暂存，消息处理完后一次性同步到 GUI，每条消息只加一次锁
+                        gui_deltas = []
                         
                         try:
                             if isinstance(message, str):
@@ -1160,13 +960,9 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                                         # 0xff 已经足够准确地处理绘画结果，0xfa 只需更新状态
                                         board_state[(x, y)] = (r, g, b)
                                         
-                                        # 同步到 GUI（批量更新以减少锁竞争）
+                                        # 同步到 GUI（暂存，消息结束后批量写入以减少锁竞争）
                                         if gui_state is not None:
-                                            try:
-                                                with gui_state['lock']:
-                                                    gui_state['board_state'][(x, y)] = (r, g, b)
-                                            except Exception:
-                                                pass
+                                            gui_deltas.append(((x, y), (r, g, b)))
                                     except Exception:
                                         # 出错则跳过此条
                                         pass
@@ -1183,6 +979,14 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                             # 【修复】消息解析错误不应导致任务退出，只记录警告
                             logging.warning(f"处理消息时出错 ({err_type}): {err_msg}，跳过此消息")
                             log_last('WARNING', f"消息解析错误 ({err_type}): {err_msg}")
+
+                        # 将本条消息中的画板更新一次性写入 GUI 状态
+                        if gui_deltas:
+                            try:
+                                with gui_state['lock']:
+                                    gui_state['board_state'].update(gui_deltas)
+                            except Exception:
+                                pass
                     
                     # 正常退出循环（连接关闭）
                     logging.info(f"WebSocket 消息流结束（共接收 {message_count} 条消息），接收任务退出。")
@@ -1241,8 +1045,9 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                         logging.info(f"成功重新获取画板快照，包含 {len(snapshot)} 个像素")
                         # 更新 GUI
                         if gui_state is not None:
+                            board_copy = board_state.copy()
                             with gui_state['lock']:
-                                gui_state['board_state'] = board_state.copy()
+                                gui_state['board_state'] = board_copy
                 except Exception as e:
                     logging.warning(f"重新获取画板快照失败: {e}")
                 finally:
@@ -1255,8 +1060,9 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                 
                 # 使用 rich 渲染更美观的进度条
                 mode_prefix = f"[{len(images_data)}图] "
-                history = deque()
                 window_seconds = 60.0
+                # 每秒追加一次，使用 maxlen 自动丢弃最旧记录，无需按时间戳逐个弹出
+                history = deque(maxlen=int(window_seconds) + 2)
                 
                 # 用于计算每秒成功绘制像素数（基于 stats['success']）
                 pixels_history = deque()  # [(timestamp, success_count), ...]
@@ -1283,6 +1089,9 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                 progress.start()
                 # 立即更新一次，确保进度条显示
                 progress.update(task_id, completed=0)
+                # 与 target_positions 一一对应的目标颜色列表，仅在目标变化（如刷新配置）时重建
+                target_colors = []
+                colors_built_for = (None, None)
                 try:
                     while True:
                         # 记录当前时间，供后续多个指标使用
@@ -1296,7 +1105,10 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                             if int(now) % 10 == 0:
                                 asyncio.create_task(try_refetch_snapshot())
                         else:
-                            mismatched = len([pos for pos in target_positions if board_state.get(pos) != target_map[pos]])
+                            if colors_built_for[0] is not target_positions or colors_built_for[1] is not target_map:
+                                target_colors = list(map(target_map.__getitem__, target_positions))
+                                colors_built_for = (target_positions, target_map)
+                            mismatched = tool.count_mismatched(board_state, target_positions, target_colors)
                         completed = max(0, total - mismatched)
                         pct = (completed / total * 100) if total > 0 else 100.0
                         
@@ -1382,8 +1194,6 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                         # maintain history and compute average growth
                         try:
                             history.append((now, pct))
-                            while history and (now - history[0][0] > window_seconds):
-                                history.popleft()
                             growth = None
                             growth_str = ''
                             eta_str = ''
@@ -1759,10 +1569,12 @@ async def handle_websocket(config, users_with_tokens, images_data, debug=False,
                                 target_positions.extend(positions_by_mode[mode])
                         
                         if gui_state is not None:
+                            reload_mismatched = tool.count_mismatched(board_state, target_positions, map(target_map.__getitem__, target_positions))
+                            reload_pos_map = dict(pos_to_image_idx)
                             with gui_state['lock']:
                                 gui_state['total'] = len(target_positions)
-                                gui_state['mismatched'] = len([pos for pos in target_positions if board_state.get(pos) != target_map[pos]])
-                                gui_state['pos_to_image_idx'] = dict(pos_to_image_idx)
+                                gui_state['mismatched'] = reload_mismatched
+                                gui_state['pos_to_image_idx'] = reload_pos_map
                         logging.info('已根据 GUI 请求刷新目标像素与绘制顺序。')
                     except Exception:
                         logging.exception('处理 GUI 刷新请求时出错')
@@ -76,6 +76,7 @@ import time
 import requests
 import os
 from PIL import Image
+import numpy as np
 
 # 配置常量
 API_BASE_URL = "https://paintboard.luogu.me"
@@ -254,6 +255,7 @@ def fetch_board_snapshot():
     
     注意：使用 proxies={} 参数禁用代理，避免修改全局环境变量影响并发的绘制任务
     """
+    import tool
     url = f"{API_BASE_URL}/api/paintboard/getboard"
     try:
         # 直接在请求中禁用代理，不修改全局环境变量
@@ -261,13 +263,7 @@ def fetch_board_snapshot():
         resp.raise_for_status()
         data = resp.content
         
-        board = {}
-        for y in range(600):
-            for x in range(1000):
-                offset = (y * 1000 + x) * 3
-                if offset + 2 < len(data):
-                    r, g, b = data[offset], data[offset+1], data[offset+2]
-                    board[(x, y)] = (r, g, b)
+        board = tool.parse_board_snapshot(data)
         
         logging.debug("已获取画板快照")
         return board
@@ -287,12 +283,8 @@ async def fetch_board_snapshot_async():
 
 def calculate_matching_pixels(board, target_map):
     """计算画板上有多少像素与目标一致"""
-    matching = 0
-    for pos, target_color in target_map.items():
-        board_color = board.get(pos)
-        if board_color == target_color:
-            matching += 1
-    return matching
+    import tool
+    return tool.count_matching(board, target_map)
 
 
 def calculate_enemy_tokens(p_me, user_cd, num_my_tokens, enemy_area, overlap_area, my_efficiency=1.0):
@@ -712,7 +704,6 @@ async def run_test_phase(config, users_with_tokens, test_image_config, show_prog
 async def main_test(config, users_with_tokens):
     """测试模式主入口 - 使用单次绘制计算敌对势力token数"""
     import tool
-    from main import build_target_map
     
     # 获取用户输入
     test_params = get_user_input()
@@ -754,13 +745,13 @@ async def main_test(config, users_with_tokens):
     # 加载生成的测试图像
     try:
         img = Image.open(used_png).convert('RGBA')
-        pixels = list(img.getdata())
+        pixels = np.asarray(img)
     except Exception as e:
         print(f"❌ 无法加载 {used_png}: {e}")
         return
     
     # 构建目标映射
-    target_map = build_target_map(pixels, TEST_IMAGE_SIZE[0], TEST_IMAGE_SIZE[1], start_x, start_y, config)
+    target_map = tool.build_target_map(pixels, TEST_IMAGE_SIZE[0], TEST_IMAGE_SIZE[1], start_x, start_y, config)
     total_pixels = len(target_map)
     
     test_image_config = [{
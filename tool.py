@@ -6,11 +6,14 @@ import json
 import time
 import random
 import struct
+from operator import eq, ne
 from uuid import UUID
 from PIL import Image
+import numpy as np
 import asyncio
 import websockets
 from collections import deque
+from itertools import chain, repeat
 
 # --- 日志记录到 last.log ---
 LAST_LOG_FILE = "last.log"
@@ -28,24 +31,24 @@ def log_last(level: str, message: str):
 # 【重要】心跳处理已分离到 ping.py 模块，此处仅处理绘画操作
 # 全局粘包队列（供 send_paint_data 与 paint 使用）
 # 粘包队列仅用于绘画操作(0xfe)，不包含心跳包(0xfb/0xfc)
-paint_queue = []
+# 使用单个可增长的 bytearray 作为缓冲区：追加时原地扩展（均摊 O(1)），避免保存大量小 bytes 对象
+paint_queue = bytearray()
 total_size = 0
 
 def append_to_queue(paint_data):
-    """将绘画数据添加到粘包队列"""
+    """将绘画数据追加到粘包缓冲区"""
     global paint_queue, total_size
-    paint_queue.append(paint_data)
-    total_size += len(paint_data)
+    paint_queue += paint_data
+    total_size = len(paint_queue)
 
 def get_merged_data():
-    """合并队列中的所有数据块并清空队列"""
+    """取出缓冲区中的全部数据并清空缓冲区"""
     global paint_queue, total_size
     if not paint_queue:
         return None
-    # 优化：使用 join 代替手动切片赋值，大幅提升合并速度
-    merged = b''.join(paint_queue)
-    # 【修复】使用 clear() 代替 = []，避免并发环境下的引用问题
-    paint_queue.clear()
+    # 直接交出当前缓冲区并换上新的空缓冲区（零拷贝）；调用方独占返回的 bytearray
+    merged = paint_queue
+    paint_queue = bytearray()
     total_size = 0
     return merged
 
@@ -129,6 +132,18 @@ def filter_pong_from_data(data):
     return bytes(result) if len(result) > 0 else None
 
 
+# 预编译的绘画包格式（31 字节），避免每次调用 struct.pack 时解析格式字符串
+# < = little-endian
+# B = uchar (1) -> 0xfe
+# H = ushort (2) -> x
+# H = ushort (2) -> y
+# 3B = 3 uchar -> r, g, b
+# 3s = 3 bytes -> uid_bytes3
+# 16s = 16 bytes -> token_bytes
+# I = uint (4) -> paint_id
+PAINT_PACKET = struct.Struct('<BHH3B3s16sI')
+
+
 def paint(ws, uid, token_bytes, uid_bytes3, r, g, b, x, y, paint_id):
     """准备绘画数据并加入队列（轻量同步函数，避免不必要的 await）
 
@@ -137,20 +152,50 @@ def paint(ws, uid, token_bytes, uid_bytes3, r, g, b, x, y, paint_id):
     要求传入已预计算的 token_bytes (16 bytes) 与 uid_bytes3 (3 bytes)，以减少开销。
     """
     try:
-        # 优化：使用 struct.pack 一次性打包，比 bytearray 切片赋值快且内存分配更高效
-        # < = little-endian
-        # B = uchar (1) -> 0xfe
-        # H = ushort (2) -> x
-        # H = ushort (2) -> y
-        # 3B = 3 uchar -> r, g, b
-        # 3s = 3 bytes -> uid_bytes3
-        # 16s = 16 bytes -> token_bytes
-        # I = uint (4) -> paint_id
-        paint_data = struct.pack('<BHH3B3s16sI', 0xfe, x, y, r, g, b, uid_bytes3, token_bytes, paint_id)
+        paint_data = PAINT_PACKET.pack(0xfe, x, y, r, g, b, uid_bytes3, token_bytes, paint_id)
         append_to_queue(paint_data)
     except Exception as e:
         logging.error(f"创建绘画数据时出错: {e}")
 
+# 绘画包的紧凑结构化 dtype（无对齐填充，共 31 字节），与 PAINT_PACKET 的打包格式一致
+PAINT_PACKET_DTYPE = np.dtype([
+    ('op', 'u1'),
+    ('x', '<u2'),
+    ('y', '<u2'),
+    ('rgb', 'u1', (3,)),
+    ('uid', 'u1', (3,)),
+    ('token', 'u1', (16,)),
+    ('paint_id', '<u4'),
+])
+
+
+def paint_batch(ws, uid, token_bytes, uid_bytes3, rgb_array, xy_array, paint_ids):
+    """批量准备绘画数据并一次性加入队列
+
+    rgb_array: 形如 (N, 3) 的颜色数组；xy_array: 形如 (N, 2) 的坐标数组；
+    paint_ids: 长度为 N 的绘画 id 数组。所有包在 NumPy 中按列一次性填充，
+    避免逐包调用 paint() 的解释器开销。返回加入队列的包数量。
+    """
+    try:
+        rgb_array = np.asarray(rgb_array)
+        xy_array = np.asarray(xy_array)
+        n = len(xy_array)
+        if n == 0:
+            return 0
+        packets = np.empty(n, dtype=PAINT_PACKET_DTYPE)
+        packets['op'] = 0xfe
+        packets['x'] = xy_array[:, 0]
+        packets['y'] = xy_array[:, 1]
+        packets['rgb'] = rgb_array
+        packets['uid'] = np.frombuffer(uid_bytes3, dtype=np.uint8)
+        packets['token'] = np.frombuffer(token_bytes, dtype=np.uint8)
+        packets['paint_id'] = paint_ids
+        append_to_queue(packets.tobytes())
+        return n
+    except Exception as e:
+        logging.error(f"批量创建绘画数据时出错: {e}")
+        return 0
+
 async def send_paint_data(ws, interval_ms, wake_event=None):
     """定时发送粘合后的绘画数据包（后台任务）
     
@@ -161,7 +206,8 @@ async def send_paint_data(ws, interval_ms, wake_event=None):
     3. 如果此任务提前退出，Pong 将永远无法发送，导致 Ping timeout
     """
     try:
-        last_send = 0.0
+        min_interval = interval_ms / 1000.0
+        next_send_time = 0.0
         while True:
             # 如果队列为空，优先通过事件驱动等待以减少轮询 sleep
             if not paint_queue:
@@ -185,16 +231,16 @@ async def send_paint_data(ws, interval_ms, wake_event=None):
 
             # 检查是否有数据需要发送
             if paint_queue:
+                # 先按发送间隔限速再合并：等待期间新入队的像素会并入同一个包，
+                # 突发流量只要已过下一个发送时刻就立即发出
+                now = time.monotonic()
+                if now < next_send_time:
+                    await asyncio.sleep(next_send_time - now)
+                    now = time.monotonic()
+                next_send_time = max(now, next_send_time) + min_interval
                 merged_data = get_merged_data()
                 if merged_data:
                     try:
-                        # respect minimal send interval to avoid exceeding per-connection packet rate
-                        now = time.monotonic()
-                        min_interval = interval_ms / 1000.0
-                        elapsed = now - last_send
-                        if elapsed < min_interval:
-                            await asyncio.sleep(min_interval - elapsed)
-                        last_send = time.monotonic()
                         # 为避免单次发送过大导致阻塞或被服务器断开（服务端限制 32KB），对过大的合并数据进行切分发送
                         MAX_PACKET = 32000
                         if len(merged_data) <= MAX_PACKET:
@@ -202,9 +248,11 @@ async def send_paint_data(ws, interval_ms, wake_event=None):
                             logging.debug(f"已发送 {len(merged_data)} 字节的绘画数据（粘包）。")
                         else:
                             sent_total = 0
+                            # 通过 memoryview 切片分块，避免为每块复制数据
+                            merged_view = memoryview(merged_data)
                             # 逐块发送，并在两块之间短暂让出控制权以便处理心跳
                             for start in range(0, len(merged_data), MAX_PACKET):
-                                chunk = merged_data[start:start + MAX_PACKET]
+                                chunk = merged_view[start:start + MAX_PACKET]
                                 await ws.send(chunk)
                                 sent_total += len(chunk)
                                 # 给事件循环机会处理入站消息（例如心跳），减少响应延迟
@@ -278,66 +326,105 @@ async def send_paint_data(ws, interval_ms, wake_event=None):
         logging.info("发送任务已退出")
 
 
+def _pixels_to_rgba_array(pixels, width, height):
+    """将像素数据统一为形如 (height, width, 4) 的 uint8 RGBA 数组。
+
+    支持 np.asarray(img) 得到的 (H,W,C)/(H,W) 数组，以及旧格式的扁平列表
+    （RGBA/RGB 元组或灰度整数）。像素不足时以透明补齐，多余部分忽略。
+    """
+    total = width * height
+    if isinstance(pixels, np.ndarray):
+        if pixels.shape == (height, width, 4) and pixels.dtype == np.uint8:
+            return pixels
+        arr = pixels
+    else:
+        try:
+            arr = np.asarray(pixels, dtype=np.uint8)
+        except Exception:
+            # 元组长度不一致等异常格式：逐个规整为 RGBA
+            norm = []
+            for p in pixels:
+                try:
+                    if isinstance(p, (list, tuple)):
+                        if len(p) >= 4:
+                            norm.append((int(p[0]), int(p[1]), int(p[2]), int(p[3])))
+                        elif len(p) == 3:
+                            norm.append((int(p[0]), int(p[1]), int(p[2]), 255))
+                        elif len(p) == 1:
+                            norm.append((int(p[0]), int(p[0]), int(p[0]), 255))
+                        else:
+                            norm.append((0, 0, 0, 0))
+                    else:
+                        norm.append((int(p), int(p), int(p), 255))
+                except Exception:
+                    norm.append((0, 0, 0, 0))
+            arr = np.array(norm, dtype=np.uint8).reshape(-1, 4)
+        # 列表转换得到的是扁平的 (N, C) 或灰度 (N,)
+        if arr.ndim == 1:
+            arr = arr.reshape(-1, 1)
+    arr = np.asarray(arr, dtype=np.uint8)
+
+    # 图片数组统一为扁平的 (N, C)：(H,W,C) 为彩色，(H,W) 为灰度
+    if arr.ndim == 3:
+        arr = arr.reshape(-1, arr.shape[2])
+    elif isinstance(pixels, np.ndarray) and arr.ndim == 2 and arr.shape == (height, width):
+        arr = arr.reshape(-1, 1)
+    elif arr.ndim == 1:
+        arr = arr.reshape(-1, 1)
+
+    channels = arr.shape[1] if arr.ndim == 2 else 0
+    rgba = np.zeros((total, 4), dtype=np.uint8)
+    n = min(total, arr.shape[0]) if arr.ndim == 2 else 0
+    if channels >= 4:
+        rgba[:n] = arr[:n, :4]
+    elif channels == 3:
+        rgba[:n, :3] = arr[:n]
+        rgba[:n, 3] = 255
+    elif channels == 1:
+        rgba[:n, :3] = arr[:n]
+        rgba[:n, 3] = 255
+    # 其余通道数（如 2）视为透明
+    return rgba.reshape(height, width, 4)
+
+
 def build_target_map(pixels, width, height, start_x, start_y, config=None):
-    """构建目标像素颜色映射：{(abs_x,abs_y): (r,g,b)}，跳过透明与越界。"""
-    target = {}
-    skipped_transparent = 0
-    skipped_out_of_bounds = 0
+    """构建目标像素颜色映射：{(abs_x,abs_y): (r,g,b)}，跳过透明与越界。
+
+    使用 NumPy 一次性完成透明/越界筛选，返回的字典按行优先顺序插入。
+    """
     ignore_semi = False
     if isinstance(config, dict):
         ignore_semi = bool(config.get('ignore_semitransparent', False))
 
     total_pixels = width * height
-    for py in range(height):
-        for px in range(width):
-            idx = py * width + px
-            if idx < 0 or idx >= len(pixels):
-                continue
-            p = pixels[idx]
-            try:
-                if isinstance(p, (list, tuple)):
-                    if len(p) >= 4:
-                        r, g, b, a = p[0], p[1], p[2], p[3]
-                    elif len(p) == 3:
-                        r, g, b = p
-                        a = 255
-                    elif len(p) == 1:
-                        r = g = b = p[0]
-                        a = 255
-                    else:
-                        skipped_transparent += 1
-                        continue
-                else:
-                    r = g = b = int(p)
-                    a = 255
-            except Exception:
-                skipped_transparent += 1
-                continue
-            try:
-                if int(a) == 0:
-                    skipped_transparent += 1
-                    continue
-            except Exception:
-                pass
-            if ignore_semi:
-                try:
-                    if 0 < int(a) < 255:
-                        skipped_transparent += 1
-                        continue
-                except Exception:
-                    pass
-            abs_x, abs_y = start_x + px, start_y + py
-            if 0 <= abs_x < 1000 and 0 <= abs_y < 600:
-                target[(abs_x, abs_y)] = (int(r), int(g), int(b))
-            else:
-                skipped_out_of_bounds += 1
+    if width <= 0 or height <= 0:
+        return {}
+    rgba = _pixels_to_rgba_array(pixels, width, height)
+
+    alpha = rgba[..., 3]
+    mask = alpha > 0
+    if ignore_semi:
+        mask &= alpha == 255
+    ys, xs = np.nonzero(mask)
+    skipped_transparent = total_pixels - len(xs)
+
+    abs_x = xs + start_x
+    abs_y = ys + start_y
+    in_bounds = (abs_x >= 0) & (abs_x < 1000) & (abs_y >= 0) & (abs_y < 600)
+    skipped_out_of_bounds = int(len(xs) - np.count_nonzero(in_bounds))
+
+    colors = rgba[ys[in_bounds], xs[in_bounds], :3]
+    keys = zip(abs_x[in_bounds].tolist(), abs_y[in_bounds].tolist())
+    # 按通道 zip 直接生成 (r,g,b) 元组，比逐行 tuple() 转换更快
+    values = zip(colors[:, 0].tolist(), colors[:, 1].tolist(), colors[:, 2].tolist())
+    target = dict(zip(keys, values))
 
     logging.debug(f"目标像素数: {len(target)}（非透明且在画布范围内） 已跳过透明: {skipped_transparent} 越界: {skipped_out_of_bounds} 总像素: {total_pixels}")
     return target
 
 
-def fetch_board_snapshot(api_base_url="https://paintboard.luogu.me"):
-    """通过 HTTP 接口获取当前画板所有像素的快照，返回 dict {(x,y):(r,g,b)}。
+def fetch_board_bytes(api_base_url="https://paintboard.luogu.me"):
+    """通过 HTTP 接口获取画板原始像素数据（按行优先排列的 RGB 字节），失败返回 None。
 
     带简易重试与禁用环境代理，以提升在临时断网/代理环境下的稳定性。
     """
@@ -361,22 +448,37 @@ def fetch_board_snapshot(api_base_url="https://paintboard.luogu.me"):
                 time.sleep(delay)
                 delay = min(delay * 2, 8)
         if data is None:
-            return {}
+            return None
         expected = 1000 * 600 * 3
         if len(data) < expected:
             logging.warning(f"获取画板快照数据长度不够: {len(data)} < {expected}")
-        board = {}
-        max_len = len(data) - 2
-        for y in range(600):
-            row_base = y * 1000 * 3
-            for x in range(1000):
-                idx = row_base + x * 3
-                if idx + 2 > max_len:
-                    break
-                r = data[idx]
-                g = data[idx + 1]
-                b = data[idx + 2]
-                board[(x, y)] = (r, g, b)
+        return data
+    finally:
+        try:
+            session.close()
+        except Exception:
+            pass
+
+
+def parse_board_snapshot(data, width=1000, height=600):
+    """将画板原始 RGB 字节解析为 dict {(x,y):(r,g,b)}（按行优先插入）。
+
+    坐标与颜色均由 C 层迭代器（chain/repeat/zip 与字节切片）生成，
+    避免逐像素的 Python 循环与下标运算。数据不足时只解析完整的像素。
+    """
+    xs = chain.from_iterable(repeat(range(width), height))
+    ys = chain.from_iterable(repeat(y, width) for y in range(height))
+    colors = zip(data[0::3], data[1::3], data[2::3])
+    return dict(zip(zip(xs, ys), colors))
+
+
+def fetch_board_snapshot(api_base_url="https://paintboard.luogu.me"):
+    """通过 HTTP 接口获取当前画板所有像素的快照，返回 dict {(x,y):(r,g,b)}。"""
+    try:
+        data = fetch_board_bytes(api_base_url)
+        if data is None:
+            return {}
+        board = parse_board_snapshot(data)
         logging.debug("已获取画板快照。")
         return board
     except Exception as e:
@@ -386,23 +488,24 @@ def fetch_board_snapshot(api_base_url="https://paintboard.luogu.me"):
 
 def get_draw_order(mode: str, width: int, height: int):
     """根据模式返回绘制顺序坐标列表（相对坐标）。"""
-    coords = [(x, y) for y in range(height) for x in range(width)]
     m = (mode or '').lower()
-    if m == 'horizontal':
-        return coords
-    if m == 'concentric':
+    if m == 'concentric' and width > 0 and height > 0:
+        # 以切比雪夫距离由内向外排序；稳定排序保证同距离像素保持行优先顺序
         cx = (width - 1) / 2.0
         cy = (height - 1) / 2.0
-        return sorted(coords, key=lambda p: max(abs(p[0]-cx), abs(p[1]-cy)))
+        ys, xs = np.mgrid[0:height, 0:width]
+        dist = np.maximum(np.abs(xs - cx), np.abs(ys - cy))
+        order = np.argsort(dist.ravel(), kind='stable')
+        return list(zip((order % width).tolist(), (order // width).tolist()))
+    coords = [(x, y) for y in range(height) for x in range(width)]
     if m == 'random':
         rnd = random.Random(width * 10007 + height * 97)
         rnd.shuffle(coords)
-        return coords
     return coords
 
 
 def load_image_pixels(config):
-    """根据配置加载目标图片，返回 (pixels,width,height)。pixels 为 RGBA 四元组列表。
+    """根据配置加载目标图片，返回 (pixels,width,height)。pixels 为形如 (H,W,4) 的 RGBA 数组。
     
     兼容旧配置格式（单个 image_path）和新格式（images 列表）
     """
@@ -413,7 +516,7 @@ def load_image_pixels(config):
     try:
         img = Image.open(image_path).convert('RGBA')
         width, height = img.size
-        pixels = list(img.getdata())
+        pixels = np.asarray(img)
         logging.debug(f"已加载目标图片: {image_path} 大小: {width}x{height}")
         return pixels, width, height
     except Exception:
@@ -430,7 +533,7 @@ def load_all_images(config):
 
     返回格式：[
         {
-            'pixels': [...],
+            'pixels': ndarray (H,W,4) RGBA,
             'width': int,
             'height': int,
             'start_x': int,
@@ -459,7 +562,7 @@ def load_all_images(config):
             }]
 
     def _gen_attack_pixels(img_cfg):
-        """根据攻击配置生成 RGBA 像素列表与尺寸。背景透明，点为实心 1px。
+        """根据攻击配置生成 (H,W,4) RGBA 像素数组与尺寸。背景透明，点为实心 1px。
 
         支持 attack_kind: white | green | random
         可选字段：dot_count（默认按面积 2% 取整）
@@ -478,7 +581,7 @@ def load_all_images(config):
         kind = (img_cfg.get('attack_kind') or img_cfg.get('attack') or 'white').lower()
         rnd = random.Random(width * 1315423911 ^ height * 2654435761)
 
-        pixels = [(0, 0, 0, 0)] * total
+        pixels = np.zeros((height, width, 4), dtype=np.uint8)
         used = set()
         for _ in range(dot_count):
             # 防止死循环，尝试有限次
@@ -502,7 +605,7 @@ def load_all_images(config):
             else:
                 color = (255, 255, 255)
             try:
-                pixels[idx] = (color[0], color[1], color[2], 255)
+                pixels[idx // width, idx % width] = (color[0], color[1], color[2], 255)
             except Exception:
                 pass
         return pixels, width, height
@@ -516,7 +619,7 @@ def load_all_images(config):
         if str(img_config.get('type', '')).lower() == 'attack':
             try:
                 pixels, width, height = _gen_attack_pixels(img_config)
-                if pixels and width > 0 and height > 0:
+                if pixels is not None and width > 0 and height > 0:
                     loaded_images.append({
                         'pixels': pixels,
                         'width': width,
@@ -542,7 +645,7 @@ def load_all_images(config):
         try:
             img = Image.open(image_path).convert('RGBA')
             width, height = img.size
-            pixels = list(img.getdata())
+            pixels = np.asarray(img)
 
             loaded_images.append({
                 'pixels': pixels,
@@ -562,6 +665,20 @@ def load_all_images(config):
     return loaded_images
 
 
+def count_mismatched(board_state, positions, target_colors):
+    """统计 positions 中当前颜色与目标颜色不一致的像素数。
+
+    target_colors 需与 positions 一一对应。全部迭代在 C 层完成（map/operator），
+    不执行逐像素的 Python 字节码；board_state 中缺失的位置视为不一致。
+    """
+    return sum(map(ne, map(board_state.get, positions), target_colors))
+
+
+def count_matching(board_state, target_map):
+    """统计 target_map 中与画板当前颜色一致的像素数。"""
+    return sum(map(eq, map(board_state.get, target_map.keys()), target_map.values()))
+
+
 def merge_target_maps(images_data):
     """合并多个图片的目标映射，处理重叠像素（按权重优先级）。
     